@@ -1,19 +1,14 @@
 import pytorch_lightning as pl
 from torch.utils.data import DataLoader, random_split
-from new_uniref_dataset import UniRefDataset
+from new_uniref_dataset import UniRefDataset, LengthBucketSampler
 import torch
 
-def collate_fn(batch):
-    current_embeddings, next_embeddings, metadata, sequences, go_ids, go_terms, additional_metadata = zip(*batch)
-    return (torch.stack(current_embeddings), torch.stack(next_embeddings), 
-            list(metadata), list(sequences), list(go_ids), list(go_terms), 
-            list(additional_metadata))
-
 class dmod(pl.LightningDataModule):
     def __init__(self, uniref_file, esm_model, alphabet, device, esm_layer, max_seq_len, 
                  batch_size=512, seed_only=False,
                  max_samples=50000000, num_workers=0, random_seed=42, human_filter=1,
-                 return_difference=False):
+                 return_difference=False, embedding_cache=None, bucket_by_length=False,
+                 table_cache_dir=None):
         super().__init__()
         self.uniref_file = uniref_file
         self.esm_model = esm_model
@@ -28,6 +23,9 @@ class dmod(pl.LightningDataModule):
         self.random_seed = random_seed
         self.human_filter = human_filter
         self.return_difference = return_difference
+        self.embedding_cache = embedding_cache
+        self.bucket_by_length = bucket_by_length
+        self.table_cache_dir = table_cache_dir
         
         # Initialize these to None
         self.train_dataset = None
@@ -46,7 +44,8 @@ class dmod(pl.LightningDataModule):
             self.uniref_file, self.esm_model, self.alphabet, self.device,
             self.esm_layer, self.max_seq_len, self.seed_only,
             self.max_samples, random_seed=self.random_seed,
-            human_filter=self.human_filter, return_difference=self.return_difference
+            human_filter=self.human_filter, return_difference=self.return_difference,
+            embedding_cache=self.embedding_cache, table_cache_dir=self.table_cache_dir
         )
         
         # Check if dataset is empty
@@ -65,13 +64,25 @@ class dmod(pl.LightningDataModule):
         print(f"Test dataset size: 0")
 
     def train_dataloader(self):
-        loader = DataLoader(
-            self.train_dataset,
-            shuffle=False,
-            batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            collate_fn=collate_fn
-        )
+        # Length buckets only pay off when the ESM forward runs on the batches
+        if self.bucket_by_length and not self.train_dataset.embeddings_cached:
+            sampler = LengthBucketSampler(self.train_dataset.lengths, self.batch_size, seed=self.random_seed)
+            loader = DataLoader(
+                self.train_dataset,
+                batch_sampler=sampler,
+                num_workers=self.num_workers,
+                pin_memory=self.train_dataset.pin_memory and self.num_workers > 0,
+                collate_fn=self.train_dataset.collate
+            )
+        else:
+            loader = DataLoader(
+                self.train_dataset,
+                shuffle=False,
+                batch_size=self.batch_size,
+                num_workers=self.num_workers,
+                pin_memory=self.train_dataset.pin_memory and self.num_workers > 0,
+                collate_fn=self.train_dataset.collate
+            )
         print(f"\nTrain DataLoader:")
         print(f"Dataset size: {len(self.train_dataset)}")
         print(f"Batch size: {self.batch_size}")
@@ -1,28 +1,281 @@
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, DataLoader, Sampler, get_worker_info
 import gzip
 from Bio import SeqIO
 from datetime import datetime
+import os
 import sys
+import math
+import hashlib
 import random
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from collections.abc import Mapping
 from tqdm import tqdm
 
+# Columns consumed by the dataset, everything else in the source file is never materialized
+REQUIRED_COLUMNS = [
+    'Entry', 'Sequence', 'Organism', 'Length',
+    'Gene Ontology IDs', 'Gene Ontology (GO)',
+    'Gene Ontology (biological process)', 'Gene Ontology (cellular component)',
+    'Gene Ontology (molecular function)',
+    'Entry Name', 'Protein names', 'Gene Names',
+    'Coiled coil', 'Compositional bias', 'Domain [CC]', 'Domain [FT]', 'Motif',
+    'Protein families', 'Region', 'Repeat', 'Sequence similarities', 'Zinc finger'
+]
+
+# GO columns stored as list<string>, and whether their items are stripped
+GO_LIST_COLUMNS = {
+    'Gene Ontology IDs': True,
+    'Gene Ontology (GO)': True,
+    'Gene Ontology (biological process)': False,
+    'Gene Ontology (cellular component)': False,
+    'Gene Ontology (molecular function)': False
+}
+
+# additional_metadata key -> source column
+ADDITIONAL_METADATA_COLUMNS = {
+    'length': 'Length',
+    'go_biological': 'Gene Ontology (biological process)',
+    'go_cellular': 'Gene Ontology (cellular component)',
+    'go_molecular': 'Gene Ontology (molecular function)',
+    'entry_name': 'Entry Name',
+    'protein_names': 'Protein names',
+    'gene_names': 'Gene Names',
+    'organism': 'Organism',
+    'coiled_coil': 'Coiled coil',
+    'compositional_bias': 'Compositional bias',
+    'domain_cc': 'Domain [CC]',
+    'domain_ft': 'Domain [FT]',
+    'motif': 'Motif',
+    'protein_families': 'Protein families',
+    'region': 'Region',
+    'repeat': 'Repeat',
+    'sequence_similarities': 'Sequence similarities',
+    'zinc_finger': 'Zinc finger'
+}
+
+# Rows per chunk when streaming a legacy TSV
+TSV_CHUNK_SIZE = 1_000_000
+
+# Fixed column types for TSV chunks, so every chunk converts to the same Arrow schema
+TSV_DTYPES = {column: 'string' for column in REQUIRED_COLUMNS}
+TSV_DTYPES['Length'] = 'Int64'
+TSV_DTYPES['Organism'] = 'category'
+TSV_SCHEMA = pa.schema([
+    (column, pa.int64() if column == 'Length' else pa.string()) for column in REQUIRED_COLUMNS
+])
+# Organism is dictionary-encoded, there are far fewer distinct organisms than rows
+ORGANISM_TYPE = pa.dictionary(pa.int32(), pa.string())
+TSV_SCHEMA = TSV_SCHEMA.set(TSV_SCHEMA.get_field_index('Organism'), pa.field('Organism', ORGANISM_TYPE))
+
+HUMAN_ORGANISM = "Homo sapiens (Human)"
+
+def _load_table(path, columns=REQUIRED_COLUMNS):
+    # Load only the needed columns of a Parquet or Arrow file as a pyarrow Table
+    suffix = Path(path).suffix.lower()
+    if suffix == '.parquet':
+        table = pq.read_table(path, columns=columns, read_dictionary=['Organism'])
+    else:
+        # Arrow IPC files are memory-mapped, so reading them is zero-copy
+        table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all().select(columns)
+    organism_index = table.schema.get_field_index('Organism')
+    if not pa.types.is_dictionary(table.schema.field(organism_index).type):
+        table = table.set_column(organism_index, 'Organism', pc.dictionary_encode(table.column(organism_index)))
+    return _nan_to_null(table)
+
+def _is_human(organism):
+    # Compare the dictionary codes against the code of the human entry, instead of comparing strings
+    masks = []
+    for chunk in organism.chunks:
+        human_code = pc.index(chunk.dictionary, HUMAN_ORGANISM).as_py()
+        masks.append(pc.equal(chunk.indices, human_code))
+    return pa.chunked_array(masks, type=pa.bool_())
+
+def _filter_eligible(table, max_seq_len, human_filter):
+    # Vectorized length and organism checks based on human_filter
+    length_ok = pc.fill_null(pc.less_equal(pc.utf8_length(table.column('Sequence')), max_seq_len), False)
+    mask = length_ok
+    skipped_sequences = pc.sum(pc.invert(length_ok), min_count=0).as_py()
+    skipped_non_human = 0
+    if human_filter:
+        organism_ok = pc.fill_null(_is_human(table.column('Organism')), False)
+        mask = pc.and_(length_ok, organism_ok)
+        skipped_non_human = pc.sum(pc.and_(length_ok, pc.invert(organism_ok)), min_count=0).as_py()
+    return table.filter(mask), skipped_sequences, skipped_non_human
+
+def _load_eligible_table(path, max_seq_len, human_filter):
+    # Returns the eligible rows along with the total entry count and the skip counts
+    if Path(path).suffix.lower() in ('.parquet', '.arrow', '.feather'):
+        table = _load_table(path)
+        eligible, skipped_sequences, skipped_non_human = _filter_eligible(table, max_seq_len, human_filter)
+        return eligible, table.num_rows, skipped_sequences, skipped_non_human
+
+    # Legacy TSV export from UniProt, streamed in chunks and filtered per chunk
+    # so peak memory is bounded by the chunk size rather than the file size
+    kept = []
+    total_entries = skipped_sequences = skipped_non_human = 0
+    reader = pd.read_csv(path, sep="\t", usecols=REQUIRED_COLUMNS, dtype=TSV_DTYPES, chunksize=TSV_CHUNK_SIZE)
+    # Progress is reported per chunk, the row count isn't known without an extra pass over the file
+    for chunk in tqdm(reader, desc="Reading chunks", unit="chunk"):
+        chunk_table = pa.Table.from_pandas(chunk, schema=TSV_SCHEMA, preserve_index=False)
+        chunk_table, chunk_skipped, chunk_non_human = _filter_eligible(chunk_table, max_seq_len, human_filter)
+        kept.append(chunk_table)
+        total_entries += len(chunk)
+        skipped_sequences += chunk_skipped
+        skipped_non_human += chunk_non_human
+    table = pa.concat_tables(kept) if kept else TSV_SCHEMA.empty_table()
+    return table, total_entries, skipped_sequences, skipped_non_human
+
+def _nan_to_null(table):
+    # Normalize NaN to null once per column, so every missing cell reads back as None
+    # without a per-value check when rows are accessed
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type):
+            column = table.column(i)
+            table = table.set_column(i, field, pc.if_else(pc.is_nan(column), pa.scalar(None, field.type), column))
+    return table
+
+def _split_column(column, strip=False):
+    # Split a ';'-separated column into a list<string> column in one vectorized pass,
+    # stripping whitespace around every item if requested (missing values stay null)
+    column = pc.cast(column, pa.string())
+    if strip:
+        return pc.split_pattern_regex(pc.utf8_trim_whitespace(column), r'\s*;\s*')
+    return pc.split_pattern(column, ';')
+
+class _MetaView(Mapping):
+    # Read-only view of one row's additional_metadata, values are only read from
+    # the Arrow table when a key is accessed
+    __slots__ = ('_t', '_i')
+
+    def __init__(self, table, idx):
+        self._t = table
+        self._i = idx
+
+    def __getitem__(self, key):
+        column = ADDITIONAL_METADATA_COLUMNS[key]
+        value = self._t.column(column)[self._i].as_py()
+        if column in GO_LIST_COLUMNS:
+            return value or []
+        return value
+
+    def __iter__(self):
+        return iter(ADDITIONAL_METADATA_COLUMNS)
+
+    def __len__(self):
+        return len(ADDITIONAL_METADATA_COLUMNS)
+
+    def __reduce__(self):
+        # Materialize when sent from a DataLoader worker, rather than pickling the whole table
+        return (dict, (dict(self),))
+
+def _build_table(uniref_file, max_seq_len, max_samples, random_seed, human_filter):
+    # Read, filter and sample the input file into the dataset's Arrow table
+    print("1. Reading and filtering input file...")
+    table, total_entries, skipped_sequences, skipped_non_human = _load_eligible_table(
+        uniref_file, max_seq_len, human_filter
+    )
+    print(f"Found {total_entries:,} total entries in the file")
+
+    total_eligible = table.num_rows
+    print(f"\nProcessing complete:")
+    print(f"- Eligible sequences: {total_eligible:,}")
+    print(f"- Skipped sequences (too long): {skipped_sequences:,}")
+    print(f"- Skipped sequences (non-human): {skipped_non_human:,}")
+
+    print("\n2. Sampling sequences...")
+    # Randomly sample if we have more eligible sequences than max_samples
+    if total_eligible > max_samples:
+        print(f"Randomly sampling {max_samples:,} sequences from {total_eligible:,} eligible sequences...")
+        rng = np.random.default_rng(random_seed)
+        indices = rng.choice(total_eligible, size=max_samples, replace=False)
+        table = table.take(pa.array(indices))
+    else:
+        print("Using all eligible sequences (fewer than max_samples)...")
+    for column, strip in GO_LIST_COLUMNS.items():
+        table = table.set_column(
+            table.schema.get_field_index(column), column, _split_column(table.column(column), strip)
+        )
+    # Sequences are kept as one contiguous large_string buffer with int64 offsets
+    table = table.set_column(
+        table.schema.get_field_index('Sequence'), pa.field('Sequence', pa.large_string()),
+        pc.cast(table.column('Sequence'), pa.large_string())
+    )
+    return table.unify_dictionaries().combine_chunks()
+
+TABLE_CACHE_VERSION = 1
+
+def _table_cache_path(cache_dir, uniref_file, max_seq_len, max_samples, random_seed, human_filter):
+    # Key on the input file's identity and every argument that changes the selected rows
+    stat = os.stat(uniref_file)
+    key_fields = (
+        TABLE_CACHE_VERSION, os.path.abspath(uniref_file), stat.st_size, stat.st_mtime_ns,
+        max_seq_len, max_samples, random_seed, int(human_filter)
+    )
+    key = hashlib.sha1(repr(key_fields).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{key}.arrow")
+
+def _write_table(table, path):
+    # Write to a temporary file first so an interrupted run never leaves a partial cache behind
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def _token_lut(alphabet):
+    # Byte -> token index for the single-character residue tokens, anything else maps to <unk>
+    lut = np.full(256, alphabet.unk_idx, dtype=np.uint8)
+    for tok, idx in alphabet.tok_to_idx.items():
+        if len(tok) == 1:
+            lut[ord(tok)] = idx
+    return lut
+
+def _string_buffers(strings):
+    # Zero-based offsets and the raw bytes of a large_string array, as NumPy views
+    if len(strings) == 0:
+        return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.uint8)
+    offsets = np.frombuffer(strings.buffers()[1], dtype=np.int64)[strings.offset:strings.offset + len(strings) + 1]
+    data = strings.buffers()[2]
+    values = np.frombuffer(data, dtype=np.uint8)[offsets[0]:offsets[-1]] if data is not None else np.empty(0, dtype=np.uint8)
+    return offsets - offsets[0], values
+
+def _tokenize_sequences(seqs, lut):
+    # Map the whole large_string byte buffer through the lookup table in one pass,
+    # reusing the string offsets so each row is a zero-copy slice of residue tokens
+    offsets, values = _string_buffers(seqs)
+    return pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(lut[values]))
+
+EMBEDDING_CACHE_VERSION = 1
+
+def _embedding_cache_key(table, esm_model, esm_layer):
+    # Identify the exact rows (by Entry, in order) and the model layers an embedding cache holds
+    entries = pc.cast(table.column('Entry'), pa.large_string()).combine_chunks()
+    offsets, values = _string_buffers(entries)
+    key = hashlib.sha1()
+    key.update(offsets)
+    key.update(values)
+    key.update(repr((EMBEDDING_CACHE_VERSION, esm_layer, esm_model.embed_dim, len(esm_model.layers))).encode())
+    return key.hexdigest()
+
 class UniRefDataset(Dataset):
-    def __init__(self, uniref_file, esm_model, alphabet, device, esm_layer, max_seq_len, seed_only=False, max_samples=50000000, random_seed=42, human_filter=1, return_difference=False):
+    def __init__(self, uniref_file, esm_model, alphabet, device, esm_layer, max_seq_len, seed_only=False, max_samples=50000000, random_seed=42, human_filter=1, return_difference=False, embedding_cache=None, table_cache_dir=None):
         self.esm_model = esm_model
         self.alphabet = alphabet
         self.device = device
+        self.pin_memory = torch.device(device).type == 'cuda'
         self.max_seq_len = max_seq_len
         self.esm_layer = esm_layer
         self.seed_only = seed_only
-        self.sequences = []
-        self.metadata = []
         self.max_samples = max_samples
-        self.go_ids = []
-        self.go_terms = []
-        self.batch_converter = alphabet.get_batch_converter()
         self.return_difference = return_difference
+        self._emb = None
+        self._tokens = None
 
         # Set all random seeds for full reproducibility
         random.seed(random_seed)
@@ -39,214 +292,226 @@ class UniRefDataset(Dataset):
         sys.stdout.flush()
 
         print("\n=== Dataset Loading Process ===")
-        print("1. Reading CSV file...")
-        df = pd.read_csv(uniref_file, sep="\t")
-        print(f"Found {len(df):,} total entries in the file")
-        
-        print("\n2. Processing sequences and collecting metadata...")
-        # Initialize all eligible lists
-        all_eligible_sequences = []
-        all_eligible_metadata = []
-        all_eligible_go_ids = []
-        all_eligible_go_terms = []
-        all_eligible_lengths = []
-        all_eligible_go_biological = []
-        all_eligible_go_cellular = []
-        all_eligible_go_molecular = []
-        all_eligible_entry_names = []
-        all_eligible_protein_names = []
-        all_eligible_gene_names = []
-        all_eligible_organisms = []
-        all_eligible_coiled_coil = []
-        all_eligible_compositional_bias = []
-        all_eligible_domain_cc = []
-        all_eligible_domain_ft = []
-        all_eligible_motif = []
-        all_eligible_protein_families = []
-        all_eligible_region = []
-        all_eligible_repeat = []
-        all_eligible_sequence_similarities = []
-        all_eligible_zinc_finger = []
-        
-        skipped_sequences = 0
-        skipped_non_human = 0
-        for idx, row in tqdm(df.iterrows(), total=len(df), desc="Processing sequences"):
-            seq = row['Sequence']
-            organism = row['Organism'] if pd.notna(row['Organism']) else None
-            
-            # Modified length and organism check based on human_filter
-            length_ok = len(seq) <= max_seq_len
-            organism_ok = organism == "Homo sapiens (Human)" if human_filter else True
-            
-            if length_ok and organism_ok:
-                all_eligible_sequences.append(seq)
-                all_eligible_metadata.append(row['Entry'])
-                
-                go_ids = str(row['Gene Ontology IDs']).split(';') if pd.notna(row['Gene Ontology IDs']) else []
-                go_terms = str(row['Gene Ontology (GO)']).split(';') if pd.notna(row['Gene Ontology (GO)']) else []
-                go_ids = [gid.strip() for gid in go_ids]
-                go_terms = [term.strip() for term in go_terms]
-                all_eligible_go_ids.append(go_ids)
-                all_eligible_go_terms.append(go_terms)
-                
-                all_eligible_lengths.append(row['Length'] if pd.notna(row['Length']) else None)
-                
-                # Process GO term categories
-                all_eligible_go_biological.append(
-                    str(row['Gene Ontology (biological process)']).split(';') if pd.notna(row['Gene Ontology (biological process)']) else []
-                )
-                all_eligible_go_cellular.append(
-                    str(row['Gene Ontology (cellular component)']).split(';') if pd.notna(row['Gene Ontology (cellular component)']) else []
-                )
-                all_eligible_go_molecular.append(
-                    str(row['Gene Ontology (molecular function)']).split(';') if pd.notna(row['Gene Ontology (molecular function)']) else []
-                )
-                
-                all_eligible_entry_names.append(row['Entry Name'] if pd.notna(row['Entry Name']) else None)
-                all_eligible_protein_names.append(row['Protein names'] if pd.notna(row['Protein names']) else None)
-                all_eligible_gene_names.append(row['Gene Names'] if pd.notna(row['Gene Names']) else None)
-                all_eligible_organisms.append(row['Organism'] if pd.notna(row['Organism']) else None)
-                
-                all_eligible_coiled_coil.append(row['Coiled coil'] if pd.notna(row['Coiled coil']) else None)
-                all_eligible_compositional_bias.append(row['Compositional bias'] if pd.notna(row['Compositional bias']) else None)
-                all_eligible_domain_cc.append(row['Domain [CC]'] if pd.notna(row['Domain [CC]']) else None)
-                all_eligible_domain_ft.append(row['Domain [FT]'] if pd.notna(row['Domain [FT]']) else None)
-                all_eligible_motif.append(row['Motif'] if pd.notna(row['Motif']) else None)
-                all_eligible_protein_families.append(row['Protein families'] if pd.notna(row['Protein families']) else None)
-                all_eligible_region.append(row['Region'] if pd.notna(row['Region']) else None)
-                all_eligible_repeat.append(row['Repeat'] if pd.notna(row['Repeat']) else None)
-                all_eligible_sequence_similarities.append(row['Sequence similarities'] if pd.notna(row['Sequence similarities']) else None)
-                all_eligible_zinc_finger.append(row['Zinc finger'] if pd.notna(row['Zinc finger']) else None)
-            else:
-                if len(seq) > max_seq_len:
-                    skipped_sequences += 1
-                if human_filter and organism != "Homo sapiens (Human)":
-                    skipped_non_human += 1
-
-        total_eligible = len(all_eligible_sequences)
-        print(f"\nProcessing complete:")
-        print(f"- Eligible sequences: {total_eligible:,}")
-        print(f"- Skipped sequences (too long): {skipped_sequences:,}")
-        print(f"- Skipped sequences (non-human): {skipped_non_human:,}")
-
-        print("\n3. Sampling sequences...")
-        # Randomly sample if we have more eligible sequences than max_samples
-        if total_eligible > max_samples:
-            print(f"Randomly sampling {max_samples:,} sequences from {total_eligible:,} eligible sequences...")
-            indices = random.sample(range(total_eligible), max_samples)
-            self.sequences = [all_eligible_sequences[i] for i in tqdm(indices, desc="Sampling")]
-            self.metadata = [all_eligible_metadata[i] for i in indices]
-            self.go_ids = [all_eligible_go_ids[i] for i in indices]
-            self.go_terms = [all_eligible_go_terms[i] for i in indices]
-            
-            self.lengths = [all_eligible_lengths[i] for i in indices]
-            self.go_biological = [all_eligible_go_biological[i] for i in indices]
-            self.go_cellular = [all_eligible_go_cellular[i] for i in indices]
-            self.go_molecular = [all_eligible_go_molecular[i] for i in indices]
-            self.entry_names = [all_eligible_entry_names[i] for i in indices]
-            self.protein_names = [all_eligible_protein_names[i] for i in indices]
-            self.gene_names = [all_eligible_gene_names[i] for i in indices]
-            self.organisms = [all_eligible_organisms[i] for i in indices]
-            self.coiled_coil = [all_eligible_coiled_coil[i] for i in indices]
-            self.compositional_bias = [all_eligible_compositional_bias[i] for i in indices]
-            self.domain_cc = [all_eligible_domain_cc[i] for i in indices]
-            self.domain_ft = [all_eligible_domain_ft[i] for i in indices]
-            self.motif = [all_eligible_motif[i] for i in indices]
-            self.protein_families = [all_eligible_protein_families[i] for i in indices]
-            self.region = [all_eligible_region[i] for i in indices]
-            self.repeat = [all_eligible_repeat[i] for i in indices]
-            self.sequence_similarities = [all_eligible_sequence_similarities[i] for i in indices]
-            self.zinc_finger = [all_eligible_zinc_finger[i] for i in indices]
+        table_cache = None
+        if table_cache_dir is not None:
+            os.makedirs(table_cache_dir, exist_ok=True)
+            table_cache = _table_cache_path(table_cache_dir, uniref_file, max_seq_len, max_samples, random_seed, human_filter)
+        if table_cache is not None and os.path.exists(table_cache):
+            # Filtered and sampled table from an earlier run, memory-mapped so loading is near-free
+            print(f"Loading filtered dataset from {table_cache}...")
+            self._table = pa.ipc.open_file(pa.memory_map(table_cache, 'r')).read_all()
         else:
-            print("Using all eligible sequences (fewer than max_samples)...")
-            self.sequences = all_eligible_sequences
-            self.metadata = all_eligible_metadata
-            self.go_ids = all_eligible_go_ids
-            self.go_terms = all_eligible_go_terms
-            
-            self.lengths = all_eligible_lengths
-            self.go_biological = all_eligible_go_biological
-            self.go_cellular = all_eligible_go_cellular
-            self.go_molecular = all_eligible_go_molecular
-            self.entry_names = all_eligible_entry_names
-            self.protein_names = all_eligible_protein_names
-            self.gene_names = all_eligible_gene_names
-            self.organisms = all_eligible_organisms
-            self.coiled_coil = all_eligible_coiled_coil
-            self.compositional_bias = all_eligible_compositional_bias
-            self.domain_cc = all_eligible_domain_cc
-            self.domain_ft = all_eligible_domain_ft
-            self.motif = all_eligible_motif
-            self.protein_families = all_eligible_protein_families
-            self.region = all_eligible_region
-            self.repeat = all_eligible_repeat
-            self.sequence_similarities = all_eligible_sequence_similarities
-            self.zinc_finger = all_eligible_zinc_finger
+            # All metadata lives column-wise in a single Arrow table
+            self._table = _build_table(uniref_file, max_seq_len, max_samples, random_seed, human_filter)
+            if table_cache is not None:
+                print(f"Saving filtered dataset to {table_cache}...")
+                _write_table(self._table, table_cache)
+        self._seqs = self._table.column('Sequence').combine_chunks()
+        # Residue count per sequence, used for length bucketing
+        self.lengths = pc.utf8_length(self._seqs).to_numpy().astype(np.int32)
+        self._bos = torch.tensor([alphabet.cls_idx] if alphabet.prepend_bos else [], dtype=torch.int64)
+        self._eos = torch.tensor([alphabet.eos_idx] if alphabet.append_eos else [], dtype=torch.int64)
 
         print("\n=== Dataset Loading Summary ===")
-        print(f"Final dataset size: {len(self.sequences):,} sequences")
-        print(f"Average sequence length: {sum(len(seq) for seq in self.sequences)/len(self.sequences):.1f}")
+        print(f"Final dataset size: {len(self):,} sequences")
+        # Vectorized mean (None for an empty dataset, which dmod reports)
+        average_length = pc.mean(pc.utf8_length(self._seqs)).as_py() or 0.0
+        print(f"Average sequence length: {average_length:.1f}")
         print("================================")
         sys.stdout.flush()
 
+        # Reuse precomputed embeddings when a cache file for this dataset exists
+        if embedding_cache is not None and os.path.exists(embedding_cache):
+            self._load_embedding_cache(embedding_cache)
+        if self._emb is None:
+            self._tokenize()
+
+    def _tokenize(self):
+        # Tokenize every sequence once up front instead of calling the batch converter per item,
+        # only needed when items are tokens rather than cached embeddings
+        if self._tokens is None:
+            self._tokens = _tokenize_sequences(self._seqs, _token_lut(self.alphabet))
+
+    def _load_embedding_cache(self, path):
+        emb = np.load(path, mmap_mode='r')
+        if emb.shape[0] != len(self):
+            raise ValueError(f"Embedding cache {path} has {emb.shape[0]:,} rows but the dataset has {len(self):,} sequences")
+        if emb.shape[1:] != (2, self.esm_model.embed_dim):
+            raise ValueError(f"Embedding cache {path} has shape {emb.shape} but the model needs (N, 2, {self.esm_model.embed_dim})")
+        # The row count alone can't tell apart runs with another seed, filter, layer or model
+        key_path = f"{path}.key"
+        if not os.path.exists(key_path):
+            raise ValueError(f"Embedding cache {path} has no {key_path}, delete it and rerun to rebuild")
+        with open(key_path) as f:
+            cached_key = f.read().strip()
+        if cached_key != _embedding_cache_key(self._table, self.esm_model, self.esm_layer):
+            raise ValueError(f"Embedding cache {path} was computed for other sequences, layer or model, delete it or use another --embedding_cache path")
+        print(f"Using precomputed embeddings from {path}")
+        self._emb = emb
+
+    def _cached_embedding(self, idx, layer):
+        embedding = torch.from_numpy(self._emb[idx, layer].copy())
+        # bf16 caches are stored as int16, older float32 caches are read as-is
+        if embedding.dtype == torch.int16:
+            embedding = embedding.view(torch.bfloat16).to(torch.float32)
+        return embedding
+
+    @property
+    def embeddings_cached(self):
+        return self._emb is not None
+
+    def precompute_embeddings(self, out_path, batch_size=64, num_workers=0, autocast_dtype=None):
+        # Run the batched ESM forward once over the whole dataset and store
+        # both layers' mean-pooled embeddings in a [N, 2, D] .npy memmap.
+        # Values are kept as bf16 bit patterns in int16, halving the cache size
+        embedder = ESMEmbedder(self.esm_model, self.alphabet, self.device, self.esm_layer, autocast_dtype=autocast_dtype)
+        self._emb = None
+        self._tokenize()
+        # Same loader settings as dmod, but unshuffled so rows land in dataset order
+        loader = DataLoader(
+            self, batch_size=batch_size, shuffle=False, collate_fn=self.collate,
+            num_workers=num_workers, pin_memory=self.pin_memory and num_workers > 0
+        )
+
+        # Write to a temporary file first so an interrupted run never leaves a partial cache behind
+        tmp_path = f"{out_path}.tmp"
+        cache = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.int16, shape=(len(self), 2, self.esm_model.embed_dim)
+        )
+        start = 0
+        for batch in tqdm(loader, desc="Precomputing embeddings"):
+            current_embeddings, next_embeddings = embedder(batch[0])
+            end = start + current_embeddings.size(0)
+            cache[start:end, 0] = current_embeddings.to(torch.bfloat16).view(torch.int16).cpu().numpy()
+            cache[start:end, 1] = next_embeddings.to(torch.bfloat16).view(torch.int16).cpu().numpy()
+            start = end
+        cache.flush()
+        del cache
+        with open(f"{out_path}.key", 'w') as f:
+            f.write(_embedding_cache_key(self._table, self.esm_model, self.esm_layer))
+        os.replace(tmp_path, out_path)
+
+        self._load_embedding_cache(out_path)
+        # Items now come from the cache, the tokens are no longer read
+        self._tokens = None
+
     def __len__(self):
-        return len(self.sequences)
+        return self._table.num_rows
 
     def __getitem__(self, idx):
-        seq = self.sequences[idx]
-        metadata = self.metadata[idx]
-        go_ids = self.go_ids[idx]
-        go_terms = self.go_terms[idx]
-        additional_metadata = {
-            'length': self.lengths[idx],
-            'go_biological': self.go_biological[idx],
-            'go_cellular': self.go_cellular[idx],
-            'go_molecular': self.go_molecular[idx],
-            'entry_name': self.entry_names[idx],
-            'protein_names': self.protein_names[idx],
-            'gene_names': self.gene_names[idx],
-            'organism': self.organisms[idx],
-            'coiled_coil': self.coiled_coil[idx],
-            'compositional_bias': self.compositional_bias[idx],
-            'domain_cc': self.domain_cc[idx],
-            'domain_ft': self.domain_ft[idx],
-            'motif': self.motif[idx],
-            'protein_families': self.protein_families[idx],
-            'region': self.region[idx],
-            'repeat': self.repeat[idx],
-            'sequence_similarities': self.sequence_similarities[idx],
-            'zinc_finger': self.zinc_finger[idx]
-        }
-
-        # Prepare data in the format expected by batch_converter
-        data = [(metadata, seq)]
-        
-        # Convert using batch_converter
-        batch_labels, batch_strs, batch_tokens = self.batch_converter(data)
-        
+        seq = self._seqs[idx].as_py()
+        metadata = self._table.column('Entry')[idx].as_py()
+        go_ids = self._table.column('Gene Ontology IDs')[idx].as_py() or []
+        go_terms = self._table.column('Gene Ontology (GO)')[idx].as_py() or []
+        additional_metadata = _MetaView(self._table, idx)
+
+        if self._emb is not None:
+            # Cached embeddings only need a copy out of the memmap
+            current_embedding = self._cached_embedding(idx, 0)  # Shape: [D]
+            next_embedding = self._cached_embedding(idx, 1)  # Shape: [D]
+            if self.return_difference:
+                next_embedding = next_embedding - current_embedding
+            return current_embedding, next_embedding, metadata, seq, go_ids, go_terms, additional_metadata
+
+        # Pre-tokenized residues plus BOS/EOS, the ESM forward runs batched in ESMEmbedder
+        residues = torch.from_numpy(self._tokens[idx].values.to_numpy().astype(np.int64))
+        tokens = torch.cat([self._bos, residues, self._eos])
+        return tokens, metadata, seq, go_ids, go_terms, additional_metadata
+
+    def _pin(self, tensor):
+        # Page-locked batches let the host-to-GPU copy run asynchronously. Workers can't
+        # touch CUDA, so batches from workers are pinned by the DataLoader instead
+        if self.pin_memory and get_worker_info() is None:
+            return tensor.pin_memory()
+        return tensor
+
+    def collate(self, batch):
+        if self._emb is not None:
+            current_embeddings, next_embeddings, metadata, sequences, go_ids, go_terms, additional_metadata = zip(*batch)
+            return (self._pin(torch.stack(current_embeddings)), self._pin(torch.stack(next_embeddings)),
+                    list(metadata), list(sequences), list(go_ids), list(go_terms),
+                    list(additional_metadata))
+
+        # Pad the per-sample tokens into one batch, as batch_converter would for the whole batch
+        tokens, metadata, sequences, go_ids, go_terms, additional_metadata = zip(*batch)
+        batch_tokens = torch.nn.utils.rnn.pad_sequence(
+            tokens, batch_first=True, padding_value=self.alphabet.padding_idx
+        )
+        return (self._pin(batch_tokens), list(metadata), list(sequences), list(go_ids), list(go_terms),
+                list(additional_metadata))
 
 
+class LengthBucketSampler(Sampler):
+    # Yields batches of indices with similar sequence lengths, so the padded ESM
+    # forward spends as little compute as possible on padding tokens
+    def __init__(self, lengths, batch_size, buckets=32, shuffle_within_bucket=True, seed=42):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.buckets = buckets
+        self.shuffle_within_bucket = shuffle_within_bucket
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        # Split the length-sorted indices into equally sized buckets and batch within each bucket
+        order = np.argsort(self.lengths, kind='stable')
+        for bucket in np.array_split(order, self.buckets):
+            if self.shuffle_within_bucket:
+                bucket = rng.permutation(bucket)
+            for start in range(0, len(bucket), self.batch_size):
+                yield bucket[start:start + self.batch_size].tolist()
+
+    def __len__(self):
+        bucket_sizes = [len(bucket) for bucket in np.array_split(np.arange(len(self.lengths)), self.buckets)]
+        return sum(math.ceil(size / self.batch_size) for size in bucket_sizes)
+
+
+class ESMEmbedder:
+    # Computes mean-pooled ESM embeddings for a padded token batch on the main process,
+    # so the Dataset stays CPU-only and can be used with DataLoader workers
+    def __init__(self, esm_model, alphabet, device, esm_layer, return_difference=False, autocast_dtype=None):
+        self.esm_model = esm_model
+        self.alphabet = alphabet
+        self.device = device
+        self.esm_layer = esm_layer
+        self.return_difference = return_difference
+        # e.g. torch.bfloat16 to run the forward under autocast, None keeps full precision
+        self.autocast_dtype = autocast_dtype
+
+    @staticmethod
+    def _masked_mean(representations, mask, lengths):
+        # [B, 1, T] @ [B, T, D] sums the residue positions without a masked [B, T, D] copy,
+        # only the pooled [B, D] result is upcast to fp32
+        summed = torch.bmm(mask.unsqueeze(1).to(representations.dtype), representations).squeeze(1)
+        return summed.float() / lengths[:, None]
+
+    def __call__(self, batch_tokens):
+        batch_tokens = batch_tokens.to(self.device, non_blocking=True)
+
         # Compute ESM embeddings for both current and next layer
-        with torch.no_grad():
+        with torch.inference_mode(), torch.autocast(
+            device_type=torch.device(self.device).type,
+            dtype=self.autocast_dtype,
+            enabled=self.autocast_dtype is not None
+        ):
             results = self.esm_model(
-                batch_tokens.to(self.device), 
+                batch_tokens,
                 repr_layers=[self.esm_layer, self.esm_layer + 1],
                 return_contacts=False
             )
-        
-
-        # Extract embeddings but no bos and eos tokens
-        current_embedding = results["representations"][self.esm_layer][0, 1:-1]  # Shape: [L, D]
-        next_embedding = results["representations"][self.esm_layer + 1][0, 1:-1]  # Shape: [L, D]
-        
-        # Mean pool both embeddings
-        current_embedding = torch.mean(current_embedding, dim=0)  # Shape: [D]
-        next_embedding = torch.mean(next_embedding, dim=0)  # Shape: [D]
-        difference_embedding = next_embedding - current_embedding  # Shape: [D]
-        
-        if self.return_difference:
-            return current_embedding, difference_embedding, metadata, seq, go_ids, go_terms, additional_metadata
-        else:
-            return current_embedding, next_embedding, metadata, seq, go_ids, go_terms, additional_metadata
 
+        # Mean pool over residue tokens only
+        mask = (
+            (batch_tokens != self.alphabet.padding_idx)
+            & (batch_tokens != self.alphabet.cls_idx)
+            & (batch_tokens != self.alphabet.eos_idx)
+        )  # Shape: [B, T]
+        lengths = mask.sum(dim=1).clamp_min(1)  # Shape: [B]
+        current_embeddings = self._masked_mean(results["representations"][self.esm_layer], mask, lengths)
+        next_embeddings = self._masked_mean(results["representations"][self.esm_layer + 1], mask, lengths)
 
+        if self.return_difference:
+            return current_embeddings, next_embeddings - current_embeddings
+        return current_embeddings, next_embeddings
@@ -15,6 +15,7 @@ import pandas as pd  # Add this import for CSV handling
 # Custom module imports
 from sparse_auto_script import LitLit 
 from dataa import dmod  # Custom data module
+from new_uniref_dataset import ESMEmbedder  # Batched ESM forward outside the DataLoader
 
 def parse_args():
     """Parse and validate command line arguments."""
@@ -48,6 +49,16 @@ def parse_args():
                         help="Whether to filter for human sequences only (1: human only, 0: all organisms)")
     parser.add_argument("--output_dir", type=str, default="Extracted_Data",
                         )
+    parser.add_argument("--num_workers", type=int, default=0,
+                        help="Number of DataLoader workers used for tokenization")
+    parser.add_argument("--bf16_inference", type=int, default=0, choices=[0, 1],
+                        help="Whether to run the ESM forward under bfloat16 autocast (faster, but not bit-identical to full precision)")
+    parser.add_argument("--bucket_by_length", type=int, default=0, choices=[0, 1],
+                        help="Whether to batch sequences of similar length together to reduce padding (changes the output order)")
+    parser.add_argument("--table_cache_dir", type=str, default=None,
+                        help="Directory for an Arrow cache of the filtered and sampled dataset, reused on later runs")
+    parser.add_argument("--embedding_cache", type=str, default=None,
+                        help="Path to a .npy cache of ESM embeddings, created on the first run (must match the dataset and ESM arguments)")
     return parser.parse_args()
 
 def format_go_terms(terms):
@@ -114,9 +125,18 @@ def main():
     # Initialize data module with all parameters
     data_module = dmod(
         args.uniref_file, esm_model, alphabet, device, args.esm_layer,
-        args.max_seq_len, batch_size=args.batch_size, seed_only=False, max_samples=args.max_samples, num_workers=0,
-        random_seed=args.random_seed, human_filter=args.human_filter, return_difference=True
+        args.max_seq_len, batch_size=args.batch_size, seed_only=False, max_samples=args.max_samples, num_workers=args.num_workers,
+        random_seed=args.random_seed, human_filter=args.human_filter, return_difference=True,
+        embedding_cache=args.embedding_cache, bucket_by_length=args.bucket_by_length,
+        table_cache_dir=args.table_cache_dir
     )
+    if args.embedding_cache is not None and not data_module.train_dataset.embeddings_cached:
+        data_module.train_dataset.precompute_embeddings(
+            args.embedding_cache, batch_size=args.batch_size, num_workers=args.num_workers,
+            autocast_dtype=torch.bfloat16 if args.bf16_inference else None
+        )
+    embedder = ESMEmbedder(esm_model, alphabet, device, args.esm_layer, return_difference=True,
+                           autocast_dtype=torch.bfloat16 if args.bf16_inference else None)
 
     # Initialize files dictionary only for non-separate case
     files = {}
@@ -144,9 +164,13 @@ def main():
 
             with torch.no_grad():
                 for batch in tqdm(data_module.train_dataloader(), desc="Processing batches"):
-                    embeddings, next_embeddings, metadata, sequences, go_ids, go_terms, additional_metadata = batch
-                    
-                    embeddings = embeddings.to(device)
+                    if data_module.train_dataset.embeddings_cached:
+                        embeddings, next_embeddings, metadata, sequences, go_ids, go_terms, additional_metadata = batch
+                        embeddings = embeddings.to(device, non_blocking=True)
+                    else:
+                        batch_tokens, metadata, sequences, go_ids, go_terms, additional_metadata = batch
+                        # Single batched ESM forward on the main process
+                        embeddings, next_embeddings = embedder(batch_tokens)
 
                     ln, mean, std = model.model.feature_normalizer.forward(embeddings)
                     shifted_input = ln - model.model.weights[3]